@@ -6,18 +6,30 @@ __email__ = "shane.drabing@gmail.com"
 # IMPORTS
 
 
+import collections
+import concurrent.futures
 import csv
-import json
+import functools
+import heapq
+import itertools
 import math
 import os
 import random
 import re
+import shelve
+import shlex
 import statistics
+import subprocess
 import sys
+import textwrap
+import threading
 import time
 
-import bs4
+import lxml.etree
+import orjson
 import requests
+import requests.adapters
+import urllib3
 
 
 # CONSTANTS
@@ -29,10 +41,36 @@ FORM_NCBI = "https://{}.ncbi.nlm.nih.gov/{}".format
 FORM_EUTILS = FORM_NCBI("eutils", "entrez/eutils/{}.cgi").format
 
 TUP_LINKNAME = ("pubmed_pubmed_citedin", "pubmed_pubmed_five")
+TUP_HEX = tuple("{:02X}".format(i) for i in range(256))
+
+NCBI_API_KEY = os.environ.get("NCBI_API_KEY")
+RATE_EUTILS = (0.35 if NCBI_API_KEY is None else 0.11)
+SIZE_EFETCH = 200
+SIZE_ELINK = 200
+SIZE_POOL = (3 if NCBI_API_KEY is None else 10)
+SIZE_ARTICLES = 4096
+TTL_ELINK = 7 * 24 * 60 * 60
+
+SESSION = requests.Session()
+SESSION.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=urllib3.Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("POST",),
+        raise_on_status=False,
+    )
+))
+
+# a cut-off body can also surface from urllib3 or as unfinished xml
+TUP_NETERR = (
+    requests.RequestException,
+    urllib3.exceptions.HTTPError,
+    lxml.etree.XMLSyntaxError,
+)
 
-tmp = '{} [label="{}" href="{}" tooltip="{}" fillcolor="{}" margin={}]'
-FORM_NODE = tmp.format
-FORM_EDGE = "{}:n->{}:s [penwidth={}]".format
 FORM_GRAPH = """
 digraph {{
 
@@ -41,7 +79,7 @@ layout=dot
 rankdir=BT
 ranksep=0.5
 nodesep=0.0
-splines=true
+splines={}
 outputorder=edgesfirst
 
 node [shape=note style=filled fontsize=9
@@ -72,23 +110,9 @@ def adjust(text, target=":", shift=2):
 
 
 def wrap(text, length=80):
-    words = text.replace("-", "- ").split()
-    if len(words) < 2:
-        return text
-
-    lines = list()
-    line, *words = words
-    for x in words:
-        trial = " ".join((line, x))
-        if len(trial) < length:
-            line = trial
-        else:
-            lines.append(line.replace("- ", "-"))
-            line = x
-    if line:
-        lines.append(line.replace("- ", "-"))
-
-    return "\n".join(lines)
+    # lines stay strictly shorter than length, words are never split
+    lines = textwrap.wrap(text, width=length - 1, break_long_words=False)
+    return "\n".join(lines) or text
 
 
 def tokenize(x):
@@ -97,18 +121,39 @@ def tokenize(x):
     return PATTERN_WORD.findall(x)
 
 
+def itokenize(x):
+    if x is None:
+        return iter(())
+    return (m.group() for m in PATTERN_WORD.finditer(x))
+
+
+def chunks(itr, size):
+    itr = tuple(itr)
+    return tuple(itr[i:i + size] for i in range(0, len(itr), size))
+
+
+def pairwise(itr):
+    a, b = itertools.tee(itr)
+    next(b, None)
+    return zip(a, b)
+
+
+def token_counts(x):
+    return table(map(str.upper, itokenize(x)))
+
+
 def jaccard(x, y, use_counts=True):
-    wx = tuple(map(str.upper, tokenize(x)))
-    wy = tuple(map(str.upper, tokenize(y)))
-    tx = table(wx)
-    ty = table(wy)
+    return jaccard_counters(token_counts(x), token_counts(y), use_counts)
+
 
-    union = set(tx) | set(ty)
-    intersection = set(tx) & set(ty)
+def jaccard_counters(tx, ty, use_counts=True, total=None):
+    union = tx.keys() | ty.keys()
+    intersection = tx.keys() & ty.keys()
     if not use_counts:
         return len(intersection) / len(union)
 
-    total = sum((*tx.values(), *ty.values()))
+    if total is None:
+        total = sum(tx.values()) + sum(ty.values())
     shared = sum(tx[k] + ty[k] for k in intersection)
     if total == 0:
         return 0
@@ -120,9 +165,7 @@ def jaccard(x, y, use_counts=True):
 
 
 def table(itr):
-    itr = tuple(itr)
-    lst = sorted(set(itr))
-    return dict(zip(lst, map(itr.count, lst)))
+    return collections.Counter(itr)
 
 
 def scale(itr):
@@ -150,8 +193,7 @@ def from_base(lst, base):
 def hex(n):
     if not 0 <= n < 256:
         raise ValueError("number out of range")
-    lst = ([0] + to_base(n, 16))[-2:]
-    return "".join("0123456789ABCDEF"[i] for i in lst)
+    return TUP_HEX[n]
 
 
 def lerp(x, y, i):
@@ -165,51 +207,81 @@ def lerp_vec(x, y, i):
 # FUNCTIONS (TIME)
 
 
-def rate_limit(key, interval, lookup=dict()):
-    if key not in lookup:
-        lookup[key] = 0
-    while (time.monotonic() - lookup[key]) < interval:
-        time.sleep(0.01)
-    lookup[key] = time.monotonic()
+def rate_limit(key, interval, lookup=dict(), lock=threading.Lock()):
+    # reserve the next free slot, then wait for it outside the lock
+    with lock:
+        slot = max(time.monotonic(), lookup.get(key, 0) + interval)
+        lookup[key] = slot
+    time.sleep(max(0, slot - time.monotonic()))
 
 
 # FUNCTIONS (XML)
 
 
-def soup(resp):
-    if (resp.status_code != 200):
-        return None
-    return bs4.BeautifulSoup(resp.content, "lxml")
+def parse_xml(resp):
+    with resp:
+        if (resp.status_code != 200):
+            return None
+
+        # let the parser pull from the socket, gunzipping as it goes
+        resp.raw.decode_content = True
+        parser = lxml.etree.XMLParser(huge_tree=True, recover=True)
+        try:
+            return lxml.etree.parse(resp.raw, parser).getroot()
+        except urllib3.exceptions.HTTPError as e:
+            # requests only wraps these when it reads the body itself
+            raise requests.ConnectionError(e, request=resp.request) from e
 
 
 def text(node, sep=str(), strip=True):
     if node is None:
         return
-    text = node.get_text(sep)
-    if text is None:
-        text = str()
+    text = sep.join(node.itertext())
     if bool(strip):
         return text.strip()
     return text
 
 
-def select_text(node, selector, sep=str(), strip=True, many=False):
+@functools.lru_cache(maxsize=256)
+def xpath(path):
+    return lxml.etree.XPath(path)
+
+
+def select_text(node, path, sep=str(), strip=True, many=False):
+    nodes = xpath(path)(node)
     if bool(many):
-        return tuple(text(x, sep, strip) for x in node.select(selector))
-    return text(node.select_one(selector), sep, strip)
+        return tuple(text(x, sep, strip) for x in nodes)
+    return text(nodes[0] if nodes else None, sep, strip)
+
+
+def iterparse(resp, tag):
+    with resp:
+        if (resp.status_code != 200):
+            return
+
+        resp.raw.decode_content = True
+        context = lxml.etree.iterparse(resp.raw, tag=tag, huge_tree=True)
+        try:
+            for _, node in context:
+                yield node
+
+                # free the finished subtree and anything parsed before it
+                node.clear()
+                while node.getprevious() is not None:
+                    del node.getparent()[0]
+        except urllib3.exceptions.HTTPError as e:
+            raise requests.ConnectionError(e, request=resp.request) from e
 
 
 # FUNCTIONS (EUTILS)
 
 
-def eutils(cgi, tries=3, **options):
-    rate_limit("eutils", 0.35)
+def eutils(cgi, **options):
+    rate_limit("eutils", RATE_EUTILS)
     url = FORM_EUTILS(cgi)
-    resp = None
-    while (resp is None) or (tries <= 0) and (resp.status_code != 200):
-        resp = requests.post(url, data=options)
-        tries -= 1
-    return resp
+    if NCBI_API_KEY is not None:
+        options["api_key"] = NCBI_API_KEY
+    return SESSION.post(url, data=options, timeout=30, stream=True)
 
 
 def esearch_pubmed(term):
@@ -218,8 +290,10 @@ def esearch_pubmed(term):
 
 def esearch_pubmed_pmids(term):
     resp = esearch_pubmed(term)
-    xml = soup(resp)
-    return select_text(xml, "id", many=True)
+    xml = parse_xml(resp)
+    if xml is None:
+        return tuple()
+    return select_text(xml, "IdList/Id", many=True)
 
 
 def efetch_pubmed(pmids):
@@ -227,64 +301,84 @@ def efetch_pubmed(pmids):
     return eutils("efetch", db="pubmed", retmode="xml", id=str_pmids)
 
 
-def efetch_pubmed_articles(pmids):
-    lst = list()
-
-    resp = efetch_pubmed(pmids)
-    xml = soup(resp)
-    if xml is None:
-        return lst
-
-    articles = xml.select("pubmedarticle")
-
-    for article in articles:
-        journal = article.select_one("journal")
-        authors = article.select("author")
-    
-        dct = {
-            "pmid": select_text(article, "pmid"),
-            "title": select_text(article, "articletitle"),
-            "authors": tuple(map(author_full, authors)),
-            "journal": select_text(journal, "title"),
-            "date": select_text(journal, "pubdate", sep=" "),
-            "abstract": select_text(article, "abstracttext"),
-            "references": select_text(article, "reference articleid", many=1)
+def efetch_pubmed_parse(resp):
+    for article in iterparse(resp, "PubmedArticle"):
+        journal = article.find(".//Journal")
+        date = select_text(journal, ".//PubDate", sep=" ")
+        refs = select_text(article, ".//Reference//ArticleId", many=True)
+
+        yield {
+            "pmid": select_text(article, "MedlineCitation/PMID"),
+            "title": select_text(article, ".//ArticleTitle"),
+            "authors": tuple(map(author_full, article.iter("Author"))),
+            "journal": select_text(journal, "Title"),
+            "date": (None if date is None else " ".join(date.split())),
+            "abstract": select_text(article, ".//AbstractText"),
+            "references": refs
         }
 
-        lst.append(dct)
-    return lst
 
+def efetch_pubmed_articles(pmids, lookup=collections.OrderedDict()):
+    pmids = tuple(dict.fromkeys(map(str, pmids)))
 
-def elink_pubmed(pmid):
-    return eutils(
-        "elink", dbfrom="pubmed", db="pubmed", cmd="neighbor_score", id=pmid
-    )
+    # only hit the server for articles we have not seen yet
+    found = dict()
+    for x in pmids:
+        if x in lookup:
+            lookup.move_to_end(x)
+            found[x] = lookup[x]
+    missing = tuple(x for x in pmids if x not in found)
 
+    # fetch in batches, yielding articles in order as soon as they parse
+    i = 0
+    with concurrent.futures.ThreadPoolExecutor(SIZE_POOL) as pool:
+        for resp in pool.map(efetch_pubmed, chunks(missing, SIZE_EFETCH)):
+            for dct in efetch_pubmed_parse(resp):
+                found[dct["pmid"]] = lookup[dct["pmid"]] = dct
 
-# FUNCTIONS (PUBMED)
+                # keep the cache bounded, least recently used goes first
+                while len(lookup) > SIZE_ARTICLES:
+                    lookup.popitem(last=False)
 
+                while i < len(pmids) and pmids[i] in found:
+                    yield dict(found[pmids[i]])
+                    i += 1
 
-def orcid_id(node):
-    text = select_text(node, "identifier[source='ORCID']")
-    if text is None:
-        return 
-    return text.split("/")[-1]
+    # then whatever was held back by an unknown pmid
+    for x in pmids[i:]:
+        if x in found:
+            yield dict(found[x])
 
 
-def author_text(node):
-    return "{}, {} {}".format(
-        select_text(node, "lastname"),
-        select_text(node, "forename"),
-        select_text(node, "initials")
+def elink_pubmed_many(pmids):
+    # repeated ids get one linkset each, a comma list would be merged
+    return eutils(
+        "elink", dbfrom="pubmed", db="pubmed", cmd="neighbor_score",
+        id=list(pmids)
     )
 
 
+# FUNCTIONS (PUBMED)
+
+
 def author_full(node):
-    return (orcid_id(node), author_text(node))
+    # one walk over the children instead of a search per field
+    fields = dict()
+    for x in node:
+        if x.text is not None and x.get("Source") in (None, "ORCID"):
+            fields.setdefault(x.tag, x.text.strip())
+
+    orcid = fields.get("Identifier")
+    if orcid is not None:
+        orcid = orcid.split("/")[-1]
+
+    return (orcid, "{}, {} {}".format(
+        fields.get("LastName"), fields.get("ForeName"), fields.get("Initials")
+    ))
 
 
 def article_summary(dct):
-    lnames = ", ".join(x[-1].split(",")[0] for x in dct["authors"])
+    lnames = ", ".join(x[-1].split(",", 1)[0] for x in dct["authors"])
     return "\n".join((
         " PMID: " + dct["pmid"],
         adjust("Title: " + wrap(dct["title"], 69)),
@@ -293,7 +387,7 @@ def article_summary(dct):
 
 
 def article_summary_wide(dct):
-    lnames = ", ".join(x[-1].split(",")[0] for x in dct["authors"])
+    lnames = ", ".join(x[-1].split(",", 1)[0] for x in dct["authors"])
     return "\n".join((
         "Title: " + dct["title"],
         "~",
@@ -308,7 +402,7 @@ def article_summary_wide(dct):
 
 
 def article_reference(dct, k=3):
-    authors = tuple(x[-1].split(",")[0] for x in dct["authors"])
+    authors = tuple(x[-1].split(",", 1)[0] for x in dct["authors"])
     n = len(authors)
     if n == 2:
         authors_str = " & ".join(authors)
@@ -320,8 +414,72 @@ def article_reference(dct, k=3):
     return "{} ({})".format(authors_str, date_str)
 
 
-def article_link(dct):
-    resp = elink_pubmed(dct["pmid"])
+def article_label(dct, lookup=dict()):
+    # label and tooltip only depend on the article itself
+    pmid = dct["pmid"]
+    if pmid not in lookup:
+        label = wrap(article_reference(dct), 20)
+        tooltip = article_summary_wide(dct).replace('"', "'")
+        lookup[pmid] = (label, tooltip)
+    return lookup[pmid]
+
+
+def article_links(resp):
+    links = dict()
+
+    xml = parse_xml(resp)
+    if xml is None:
+        return links
+
+    # each linkset belongs to one of the requested ids
+    for linkset in xml.iterfind("LinkSet"):
+        pmid = select_text(linkset, "IdList/Id")
+        dct = links.setdefault(pmid, dict())
+        for linksetdb in linkset.iterfind("LinkSetDb"):
+            name = select_text(linksetdb, "LinkName")
+            if name not in TUP_LINKNAME:
+                continue
+            key = name.split("_")[-1]
+            dct[key] = select_text(linksetdb, "Link/Id", many=True)
+
+    return links
+
+
+def article_links_cached(pmids, lock=threading.Lock()):
+    pmids = tuple(dict.fromkeys(map(str, pmids)))
+
+    dir_out = "gref/cache/"
+    if not os.path.exists(dir_out):
+        os.makedirs(dir_out)
+
+    # the lock also keeps two threads from fetching the same pmids
+    with lock, shelve.open(dir_out + "elink") as db:
+        links = dict()
+        now = time.time()
+        for x in pmids:
+            # entries are (fetched, links), citedin grows so they expire
+            entry = db.get(x)
+            if type(entry) is tuple and now - entry[0] < TTL_ELINK:
+                links[x] = entry[1]
+
+        missing = tuple(x for x in pmids if x not in links)
+        for batch in chunks(missing, SIZE_ELINK):
+            fresh = article_links(elink_pubmed_many(batch))
+            for x in batch:
+                if x not in fresh:
+                    continue
+                links[x] = fresh[x]
+
+                # an empty linkset may be an error, so ask again next time
+                if fresh[x]:
+                    db[x] = (now, fresh[x])
+
+    return links
+
+
+def article_link(dct, links=None):
+    if links is None:
+        links = article_links_cached((dct["pmid"],))
 
     # make sure all keys are initialized
     for name in TUP_LINKNAME:
@@ -329,15 +487,7 @@ def article_link(dct):
         dct[key] = list()
 
     # then fill the actual content
-    xml_score = soup(resp)
-    linksets = xml_score.select("linksetdb")
-    for linkset in linksets:
-        name = select_text(linkset, "linkname")
-        if name not in TUP_LINKNAME:
-            continue
-        key = name.split("_")[-1]
-        value = select_text(linkset, "id", many=True)
-        dct[key] = value
+    dct.update(links.get(dct["pmid"], dict()))
 
     return dct
 
@@ -359,11 +509,15 @@ def printe(*args, **kwargs):
 
 
 def tuplefy(dct):
-    for k, v in dct.items():
-        if isinstance(v, list):
-            dct[k] = tuple(v)
-        elif isinstance(v, dict):
-            dct[k] = tuplefy(v)
+    # parsers only produce exact lists and dicts, so skip isinstance
+    stack = [dct]
+    while stack:
+        cur = stack.pop()
+        for k, v in cur.items():
+            if type(v) is list:
+                cur[k] = tuple(v)
+            elif type(v) is dict:
+                stack.append(v)
     return dct
 
 
@@ -372,131 +526,175 @@ def main_par():
         "state": State.FILEIO,
         "data": None,
         "fpath": None,
+        "dirty": False,
+        "version": 0,
+        "graph": None,
     }
 
 
 def main_load(par):
-    with open(par["fpath"] + ".json", "r", encoding="utf8") as fh:
-        par["data"] = tuplefy(json.load(fh))
+    with open(par["fpath"] + ".json", "rb") as fh:
+        par["data"] = tuplefy(orjson.loads(fh.read()))
 
 
 def main_save(par):
-    with open(par["fpath"] + ".json", "w", encoding="utf8") as fh:
-        json.dump(par["data"], fh)
+    with open(par["fpath"] + ".json", "wb") as fh:
+        fh.write(orjson.dumps(par["data"]))
+    par["dirty"] = False
 
 
 def main_search(term):
     pmids = esearch_pubmed_pmids(term)
-    lst = efetch_pubmed_articles(pmids)
-    if not lst:
+    n = 0
+    for dct in efetch_pubmed_articles(pmids):
+        if n:
+            printt()
+        printt(article_summary(dct))
+        n += 1
+    if not n:
         printe("No results!")
-    else:
-        printt("\n\n".join(map(article_summary, lst)))
 
 
 def main_add(par, pmids):
-    lst = efetch_pubmed_articles(pmids)
+    # fetch articles and their links at the same time
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        future_fetch = pool.submit(list, efetch_pubmed_articles(pmids))
+        future_link = pool.submit(article_links_cached, pmids)
+        lst = future_fetch.result()
+        links = future_link.result()
+
     if not lst:
         printe("Incorrect PMID(s)!")
+        return
+
+    for dct in lst:
+        # a failed elink leaves no entry, do not store it as unlinked
+        if dct["pmid"] not in links:
+            printe("Links missing for {}, try again!".format(dct["pmid"]))
+            continue
 
-    for dct in map(article_link, lst):
+        dct = article_link(dct, links)
         printt("Found {}...".format(dct["pmid"]))
         par["data"][dct["pmid"]] = dct
+        par["dirty"] = True
+        par["version"] += 1
 
 
 def main_grow(par):
-    counts = dict()
+    counts = table(itertools.chain.from_iterable(
+        dct.get(src, ())
+        for dct in par["data"].values()
+        for src in ("five", "references", "citedin")
+    ))
+    get = counts.get
     def anon(x):
-        return counts.get(x), random.random()
-
-    for dct in par["data"].values():
-        for src in ("five", "references", "citedin"):
-            for key in dct[src]:
-                try:
-                    counts[key] += 1
-                except KeyError:
-                    counts[key] = 1
+        return get(x), random.random()
 
     keys = set(counts) - set(par["data"])
-    pmids = tuple(sorted(keys, key=anon, reverse=True)[:5])
+    pmids = tuple(heapq.nlargest(5, keys, key=anon))
     main_add(par, pmids)
 
 
-def main_graph(par, args, echo=True):
-    dct = par["data"]
-
-    if echo is True:
-        printt(wrap(" ".join(dct.keys()), 76))
-
+def graph_source(dct, splines="true"):
+    node_set = frozenset(dct)
     edges = set()
-    for _ in range(3):
-        for k, v in dct.items():
-            if "references" in v:
-                for x in v["references"]:
-                    if x in dct and x != k:
-                        edges.add((x, k))
-            if "citedin" in v:
-                for x in v["citedin"]:
-                    if x in dct and x != k:
-                        edges.add((k, x))
-    inbound, outbound = zip(*edges)
-
-    nodes = set()
-    for x in map(set, edges):
-        nodes |= x
+    for k, v in dct.items():
+        refs = node_set.intersection(v.get("references", ())) - {k}
+        cits = node_set.intersection(v.get("citedin", ())) - {k}
+        edges.update((x, k) for x in refs)
+        edges.update((k, x) for x in cits)
+    inbound = table(x for x, _ in edges)
+    outbound = table(y for _, y in edges)
+
+    nodes = set(itertools.chain.from_iterable(edges))
     nodes = tuple(map(dct.get, sorted(nodes)))
 
-    nodes_lst = list()
-    for x in nodes:
+    rgb_out, rgb_in = (255, 220, 140), (150, 230, 255)
+
+    nodes_lst = [None] * len(nodes)
+    for i, x in enumerate(nodes):
         pmid = x["pmid"]
-        label = wrap(article_reference(x), 20)
-        href = "https://pubmed.ncbi.nlm.nih.gov/{}/".format(x["pmid"])
-        tooltip = article_summary_wide(x).replace('"', "'")
-        i1 = inbound.count(pmid)
-        i2 = outbound.count(pmid)
-        rgb = lerp_vec([255, 220, 140], [150, 230, 255], i1 / (i1 + i2))
+        label, tooltip = article_label(x)
+        href = "https://pubmed.ncbi.nlm.nih.gov/{}/".format(pmid)
+        i1 = inbound[pmid]
+        i2 = outbound[pmid]
+        rgb = lerp_vec(rgb_out, rgb_in, i1 / max(1, i1 + i2))
         color = "#" + "".join(map(hex, rgb))
         size = 0.05 + math.log10(1 + len(x["citedin"])) / 10
-        node_str = FORM_NODE(pmid, label, href, tooltip, color, size)
-        nodes_lst.append(node_str)
+        nodes_lst[i] = (
+            f'{pmid} [label="{label}" href="{href}" tooltip="{tooltip}" '
+            f'fillcolor="{color}" margin={size}]'
+        )
     nodes_str = "\n    ".join(nodes_lst)
 
-    edges_lst = list()
-    for x, y in sorted(edges):
-        size = 50 * jaccard(dct[x]["abstract"], dct[y]["abstract"]) ** 6
-        edge_str = FORM_EDGE(x, y, f"{size:.6f}")
-        edges_lst.append(edge_str)
+    tok_cache = {x["pmid"]: token_counts(x["abstract"]) for x in nodes}
+    tot_cache = {k: sum(v.values()) for k, v in tok_cache.items()}
+
+    # ortho routing ignores ports, so only ask for them with splines
+    tail, head = (("", "") if splines == "ortho" else (":n", ":s"))
+
+    edges_lst = [None] * len(edges)
+    for i, (x, y) in enumerate(sorted(edges)):
+        total = tot_cache[x] + tot_cache[y]
+        sim = jaccard_counters(tok_cache[x], tok_cache[y], total=total)
+        size = 50 * sim ** 6
+        edges_lst[i] = f"{x}{tail}->{y}{head} [penwidth={size:.6f}]"
     edges_str = "\n    ".join(edges_lst)
 
+    return FORM_GRAPH(splines, nodes_str, edges_str)
+
+
+def main_graph(par, args, echo=True):
+    dct = par["data"]
+
+    if echo is True:
+        printt(wrap(" ".join(dct.keys()), 76))
+
+    # orthogonal edges are faster to route, but opt-in
+    ortho = any(x.upper() == "ORTHO" for x in args)
+    key = (par["version"], ortho)
+
+    # only rebuild the source when the articles have changed
+    if par["graph"] is None or par["graph"][0] != key:
+        splines = ("ortho" if ortho else "true")
+        par["graph"] = (key, graph_source(dct, splines))
+    graph = par["graph"][1]
+
     dir_out = "gref/gv/"
     if not os.path.exists(dir_out):
         os.makedirs(dir_out)
 
-    graph = FORM_GRAPH(nodes_str, edges_str)
     fpath = dir_out + par["fpath"].split("/")[-1] + ".gv"
     print(graph, file=open(fpath, "w", encoding="utf8"))
 
     return fpath
 
 
-def main_render(par, args, cmd):
-    cmd = cmd.lower()
+def main_render(par, args, *cmds):
+    fpath = main_graph(par, args, echo=False)
+    name = fpath.split("/")[-1].replace(".gv", "")
+    args = [x for x in args if x.upper() != "ORTHO"]
 
-    dir_out = f"gref/{cmd}/"
-    if not os.path.exists(dir_out):
-        os.makedirs(dir_out)
+    # each format is its own dot process, so let them run side by side
+    procs = list()
+    for cmd in map(str.lower, cmds):
+        dir_out = f"gref/{cmd}/"
+        if not os.path.exists(dir_out):
+            os.makedirs(dir_out)
 
-    fpath = "gref/gv/" + par["fpath"].split("/")[-1] + ".gv"
-    main_graph(par, args, echo=False)
+        opts = (args + [200] if cmd == "png" else args)
+        dpi = (" -Gdpi={}".format(opts[0]) if opts else "")
+        expression = f"dot -T{cmd}{dpi} {fpath} -o gref/{cmd}/{name}.{cmd}"
 
-    name = fpath.split("/")[-1].replace(".gv", "")
-    if cmd == "png":
-        args += [200]
-    dpi = (" -Gdpi={}".format(args[0]) if args else "")
-    expression = f"dot -T{cmd}{dpi} {fpath} -o gref/{cmd}/{name}.{cmd}"
+        printt(expression)
+        try:
+            procs.append(subprocess.Popen(shlex.split(expression)))
+        except FileNotFoundError:
+            printe("Graphviz not found!")
+            break
 
-    printt(expression)
-    os.system(expression)
+    for proc in procs:
+        proc.wait()
 
 
 def main_table(par, args, echo=True):
@@ -541,19 +739,10 @@ def main_ngram(par, args):
         args += [2]
     n = int(args[0])
 
-    data = dict()
-    for x in dct.values():
-        words = tokenize(x["abstract"])
-        ngram = list()
-        for i in range(len(words) - n):
-            ngram.append(" ".join(words[i:i + n]))
-        for k, v in table(ngram).items():
-            try:
-                data[k] += v
-            except KeyError:
-                data[k] = v
-
-    keys = sorted(data, key=data.get, reverse=True)
+    words = (tokenize(x["abstract"]) for x in dct.values())
+    data = table(
+        " ".join(x[i:i + n]) for x in words for i in range(len(x) - n)
+    )
 
     dir_out = "gref/txt/"
     fpath = dir_out + par["fpath"].split("/")[-1] + ".txt"
@@ -561,7 +750,7 @@ def main_ngram(par, args):
     if not os.path.exists(dir_out):
         os.makedirs(dir_out)
 
-    text = "\n".join(map("{},{}".format, keys, map(data.get, keys)))
+    text = "\n".join("{},{}".format(*x) for x in data.most_common())
     print(text, file=open(fpath, "w", encoding="utf8"))
     printt("Wrote {}...".format(repr(fpath)))
 
@@ -574,41 +763,38 @@ def main_essay(par, args):
         args += [500]
     n = int(args[0])
 
-    data = dict()
-    for x in dct.values():
-        words = tokenize(x["abstract"])
-        ngram = map("{} {}".format, words, words[1:])
-        for k, v in table(ngram).items():
-            try:
-                data[k] += v
-            except KeyError:
-                data[k] = v
+    words = (itokenize(x["abstract"]) for x in dct.values())
+    data = table(itertools.chain.from_iterable(map(pairwise, words)))
 
     dct = dict()
-    for k, v in data.items():
-        w1, w2 = k.split()
+    for (w1, w2), v in data.items():
         try:
             dct[w1][w2] = v
         except KeyError:
             dct[w1] = {w2: v}
 
+    # only step to words that can be followed by another step
+    live = {k for k, v in dct.items() if any((x in dct) for x in v)}
+    cache = dict()
+
+    def successors(word):
+        if word not in cache:
+            valid = tuple((k, v) for k, v in dct[word].items() if k in live)
+            cache[word] = (
+                tuple(k for k, _ in valid),
+                tuple(itertools.accumulate(v for _, v in valid)),
+            )
+        return cache[word]
+
     word = next(iter(dct))
     lst = [word]
     for i in range(n):
-        new = None
-        stale = False
-        while new is None:
-            while new not in dct:
-                x = dct[word]
-                new, *_ = random.choices(tuple(x), weights=tuple(x.values()))
-            if not any((x in dct) for x in dct[new]):
-                if stale:
-                    word = next(iter(dct))
-                    stale = False
-                else:
-                    stale = True
-                new = None
-        word = new
+        keys, weights = successors(word)
+        if not keys:
+            keys, weights = successors(lst[0])
+        if not keys:
+            break
+        word, *_ = random.choices(keys, cum_weights=weights)
         lst.append(word)
 
     dir_out = "gref/txt/"
@@ -634,8 +820,8 @@ def main():
     # main loop
     while par["state"] != State.EXIT:
 
-        # save database (if applicable)
-        if par["state"] == State.MAIN:
+        # save database (if changed)
+        if par["state"] == State.MAIN and par["dirty"]:
             main_save(par)
 
         # prompt for input
@@ -673,10 +859,12 @@ def main():
                 ("ADD", "δ", "Add a new PubMed ID to the active file"),
                 ("GROW", "δ",
                  "Find related articles, can specify number of cycles"),
-                ("GV", "δ", "Render out a GV file, this is the base graph"),
+                ("GV", "δ",
+                 "Render out a GV file, this is the base graph, can use ORTHO"),
                 ("SVG", "δ", "Render out a SVG file, has hyperlink support"),
                 ("PDF", "δ", "Render out a PDF file"),
                 ("PNG", "δ", "Render out a PNG file, can specify DPI"),
+                ("RENDER", "δ", "Render out PNG, SVG, and PDF files at once"),
                 ("CSV", "δ", "Export articles to a table"),
                 ("TXT NGRAM", "δ",
                  "Export N-grams from all abstracts, can specify N"),
@@ -695,7 +883,10 @@ def main():
                 continue
 
             term = " ".join(args)
-            main_search(term)
+            try:
+                main_search(term)
+            except TUP_NETERR:
+                printe("Network error!")
 
         elif par["state"] == State.FILEIO:
             # overlapping checks and operations
@@ -719,6 +910,7 @@ def main():
                     printt("Making...")
                     par["data"] = dict()
                     par["state"] = State.MAIN
+                    par["dirty"] = True
 
             elif cmd == "LOAD":
                 if not fpath_exists:
@@ -781,7 +973,10 @@ def main():
                     continue
 
                 printt("Adding...")
-                main_add(par, args)
+                try:
+                    main_add(par, args)
+                except TUP_NETERR:
+                    printe("Network error!")
 
             elif cmd == "GROW":
                 if not args:
@@ -798,10 +993,14 @@ def main():
                         main_grow(par)
                 except KeyboardInterrupt:
                     printe("Aborted!")
+                except TUP_NETERR:
+                    printe("Network error!")
             elif cmd == "GV":
                 main_graph(par, args)
             elif cmd in ("PNG", "SVG", "PDF"):
                 main_render(par, args, cmd)
+            elif cmd == "RENDER":
+                main_render(par, args, "PNG", "SVG", "PDF")
             elif cmd == "CSV":
                 main_table(par, args)
             elif cmd == "TXT":
@@ -21,6 +21,6 @@ setuptools.setup(
         ("", ["LICENSE.txt"])
     ],
     install_requires=[
-        "bs4", "requests",
+        "lxml", "orjson", "requests",
     ]
 )